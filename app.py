@@ -1,15 +1,25 @@
 import os
+import re
+import json
+import asyncio
 import logging
-from typing import Dict, Any
-from pydantic import BaseModel, Field
-from langchain.prompts import PromptTemplate
-from langchain.output_parsers import PydanticOutputParser
-from langchain_core.messages import HumanMessage, AIMessage
-from langchain_community.chat_message_histories import ChatMessageHistory
-from langchain_google_genai import ChatGoogleGenerativeAI
-from flask import Flask, request, jsonify, render_template
+import hashlib
+from collections import Counter, OrderedDict, defaultdict, deque
+from contextlib import asynccontextmanager
+from uuid import uuid4
+from typing import Annotated, Deque, Dict, Any, List, Optional, Tuple, Type
+import msgspec
+import orjson
+import numpy as np
+from langchain_core.globals import set_llm_cache, get_llm_cache
+from langchain_community.cache import SQLiteCache
+from langchain_core.outputs import Generation
+from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
+from quart import Quart, g, request, render_template
 from dotenv import load_dotenv
-import requests  # Add this import
+import aiohttp
+import diskcache
+from tenacity import AsyncRetrying, retry_if_exception_type, stop_after_attempt, wait_exponential_jitter
 
 # Load environment variables from .env file
 load_dotenv()
@@ -25,36 +35,117 @@ if not api_key:
 # Set the environment variable for the Google API
 os.environ["GOOGLE_API_KEY"] = api_key
 
-# Initialize Gemini AI client
-genai_client = ChatGoogleGenerativeAI(model="gemini-1.5-pro", temperature=0.7)
-
-# Define the output structures using Pydantic
-class ThirukkuralResponse(BaseModel):
-    verse: str = Field(description="The original Thirukkural verse in Tamil")
-    translation: str = Field(description="English translation of the Thirukkural")
-    section: str = Field(description="The section name the Thirukkural belongs to (Aram, Porul, or Inbam)")
-    explanation: str = Field(description="Detailed explanation of the Thirukkural's meaning and significance")
-    story: str = Field(description="A short story or anecdote that illustrates the meaning of this Thirukkural")
-
-class BhagavadGitaResponse(BaseModel):
-    verse: str = Field(description="The original Bhagavad Gita verse in Sanskrit")
-    translation: str = Field(description="English translation of the verse")
-    chapter: str = Field(description="The chapter and verse number")
-    explanation: str = Field(description="Detailed explanation of the verse's meaning and significance")
-    story: str = Field(description="A short story or anecdote that illustrates the meaning of this verse")
-
-# Create the LangChain parsers
-thirukkural_parser = PydanticOutputParser(pydantic_object=ThirukkuralResponse)
-gita_parser = PydanticOutputParser(pydantic_object=BhagavadGitaResponse)
-
-# Define the prompt templates
-thirukkural_template = """
-You are a Thirukkural expert. Find the most relevant Thirukkural based on the user's query and the conversation context.
+# Cache Gemini completions on disk, keyed by the full prompt (query + chat history) and model settings
+set_llm_cache(SQLiteCache(database_path=os.getenv("LLM_CACHE_PATH", ".cache.db")))
 
-The user is asking about: {query}
+# Cache Azure translations on disk, keyed by the source text and target language
+translation_cache = diskcache.Cache(os.getenv("TRANSLATION_CACHE_DIR", "./trcache"))
 
-Previous conversation context: 
-{chat_history}
+# Shared HTTP session for Azure Translator calls, opened once per worker when the app starts serving
+http_session: Optional[aiohttp.ClientSession] = None
+
+# Cap on Azure Translator requests in flight per worker, to stay within the per-second quota
+azure_semaphore = asyncio.Semaphore(int(os.getenv("AZ_CONCURRENCY", "16")))
+
+# Azure Translator status codes worth retrying with backoff
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+class TranslatorRetryableError(Exception):
+    """Raised for Azure Translator responses that may succeed when retried."""
+
+# Initialize Gemini AI clients: flash for follow-up requests, pro for everything else
+flash_client = ChatGoogleGenerativeAI(model="gemini-1.5-flash", temperature=0.7)
+pro_client = ChatGoogleGenerativeAI(model="gemini-1.5-pro", temperature=0.7)
+
+# Initialize Gemini embeddings client, used to find earlier queries similar to a new one
+embeddings_client = GoogleGenerativeAIEmbeddings(model="models/embedding-001", task_type="semantic_similarity")
+
+# Minimum cosine similarity for a new query to reuse the response to an earlier query
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+
+# Maximum number of earlier queries remembered per text type
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "1000"))
+
+# Languages the generated responses are translated into
+SUPPORTED_LANGUAGES = ["ta", "hi", "ml", "te", "bn", "gu", "kn", "mr", "pa", "ur"]  # Add new languages here
+
+# Response fields that get translated
+TRANSLATED_FIELDS = ("translation", "explanation", "story")
+
+# Fields translated while the model is still generating the rest of the response
+EARLY_TRANSLATED_FIELDS = ("translation", "explanation")
+
+# Matches a completed JSON string value of an early translated field in a partially streamed response
+COMPLETED_FIELD_PATTERN = re.compile(r'"(' + "|".join(EARLY_TRANSLATED_FIELDS) + r')"\s*:\s*("(?:[^"\\]|\\.)*")')
+
+# Define the output structures as msgspec structs, decoded straight from the model's JSON output
+class ThirukkuralResponse(msgspec.Struct):
+    verse: Annotated[str, msgspec.Meta(description="The original Thirukkural verse in Tamil")]
+    translation: Annotated[str, msgspec.Meta(description="English translation of the Thirukkural")]
+    section: Annotated[str, msgspec.Meta(description="The section name the Thirukkural belongs to (Aram, Porul, or Inbam)")]
+    explanation: Annotated[str, msgspec.Meta(description="Detailed explanation of the Thirukkural's meaning and significance")]
+    story: Annotated[str, msgspec.Meta(description="A short story or anecdote that illustrates the meaning of this Thirukkural")]
+
+class BhagavadGitaResponse(msgspec.Struct):
+    verse: Annotated[str, msgspec.Meta(description="The original Bhagavad Gita verse in Sanskrit")]
+    translation: Annotated[str, msgspec.Meta(description="English translation of the verse")]
+    chapter: Annotated[str, msgspec.Meta(description="The chapter and verse number")]
+    explanation: Annotated[str, msgspec.Meta(description="Detailed explanation of the verse's meaning and significance")]
+    story: Annotated[str, msgspec.Meta(description="A short story or anecdote that illustrates the meaning of this verse")]
+
+# Create the decoders. Decoding straight into the structs checks field types while parsing, in a single
+# pass, and is faster than loading the JSON into a dict and building the struct without validation.
+thirukkural_decoder = msgspec.json.Decoder(ThirukkuralResponse)
+gita_decoder = msgspec.json.Decoder(BhagavadGitaResponse)
+
+FORMAT_INSTRUCTIONS_TEMPLATE = """The output should be formatted as a JSON instance that conforms to the JSON schema below.
+
+As an example, for the schema {{"properties": {{"foo": {{"title": "Foo", "description": "a list of strings", "type": "array", "items": {{"type": "string"}}}}}}, "required": ["foo"]}}
+the object {{"foo": ["bar", "baz"]}} is a well-formatted instance of the schema. The object {{"properties": {{"foo": ["bar", "baz"]}}}} is not well-formatted.
+
+Here is the output schema:
+```
+{schema}
+```"""
+
+# Function to render the JSON format instructions for a response struct. Properties are laid out like
+# Pydantic's schema (description, title, type), so the prompt matches what PydanticOutputParser produced.
+def get_format_instructions(struct_type: Type[msgspec.Struct]) -> str:
+    _, components = msgspec.json.schema_components([struct_type])
+    schema = components[struct_type.__name__]
+    properties = {
+        name: {"description": prop["description"], "title": name.replace("_", " ").title(), "type": prop["type"]}
+        for name, prop in schema["properties"].items()
+    }
+    schema = {"properties": properties, "required": schema["required"]}
+    return FORMAT_INSTRUCTIONS_TEMPLATE.format(schema=json.dumps(schema))
+
+# Function to extract the JSON object from the model output, dropping any markdown code fences
+def extract_json(text: str) -> str:
+    start = text.find("{")
+    end = text.rfind("}")
+    if start == -1 or end < start:
+        raise ValueError(f"No JSON object found in model output: {text!r}")
+    return text[start:end + 1]
+
+# Function to decode the model output into a response struct. The typed decoder is the fast path; models
+# often put raw control characters (such as newlines between story paragraphs) inside strings, which
+# strict JSON rejects, so those outputs are re-parsed leniently and converted, as LangChain's parser did.
+def decode_response(decoder: msgspec.json.Decoder, text: str) -> msgspec.Struct:
+    raw = extract_json(text)
+    try:
+        return decoder.decode(raw)
+    except msgspec.DecodeError:
+        return msgspec.convert(json.loads(raw, strict=False), decoder.type)
+
+# Define the prompt templates. The static instructions and format instructions come first and the
+# per-request query and chat history come last, so every prompt for a text shares an identical prefix
+# that the model provider can reuse from its prompt cache. Explicit Gemini context caching (CachedContent)
+# is not used: the static block is roughly 600 tokens, far below the 32,768-token minimum for cached
+# content on gemini-1.5 models, and the pinned google-generativeai/langchain-google-genai releases do
+# not expose it.
+thirukkural_template = """
+You are a Thirukkural expert. Find the most relevant Thirukkural based on the user's query and the conversation context.
 
 IMPORTANT INSTRUCTIONS:
 1. Based on the query and previous conversation, find a Thirukkural that best matches the user's intent.
@@ -64,16 +155,16 @@ IMPORTANT INSTRUCTIONS:
 
 Return your response in the following JSON format:
 {format_instructions}
+---
+Previous conversation context:
+{chat_history}
+
+The user is asking about: {query}
 """
 
 bhagavad_gita_template = """
 You are a Bhagavad Gita expert. Find the most relevant verse from the Bhagavad Gita based on the user's query and the conversation context.
 
-The user is asking about: {query}
-
-Previous conversation context: 
-{chat_history}
-
 IMPORTANT INSTRUCTIONS:
 1. Based on the query and previous conversation, find a verse from the Bhagavad Gita that best matches the user's intent.
 2. If the user's query seems to build on previous questions, provide a verse that relates to both the current query AND previous conversation.
@@ -82,93 +173,269 @@ IMPORTANT INSTRUCTIONS:
 
 Return your response in the following JSON format:
 {format_instructions}
+---
+Previous conversation context:
+{chat_history}
+
+The user is asking about: {query}
 """
 
-# Setup the prompts with the parsers
-thirukkural_prompt = PromptTemplate(
-    template=thirukkural_template,
-    input_variables=["query", "chat_history"],
-    partial_variables={"format_instructions": thirukkural_parser.get_format_instructions()},
-)
+# Cache of generated responses, looked up by the meaning of the query rather than its exact wording
+class SemanticCache:
+    """
+    Entries are grouped by text type and model, so a response is only reused for a query that would
+    have been answered by the same model.
+    """
+    def __init__(self, threshold: float, max_entries: int):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.vectors: Dict[Tuple[str, str], np.ndarray] = {}  # Unit query embeddings, one row per cached query
+        self.responses: Dict[Tuple[str, str], List[msgspec.Struct]] = defaultdict(list)
+
+    def lookup(self, text_type: str, model: str, vector: np.ndarray) -> Optional[msgspec.Struct]:
+        """
+        Returns the cached response whose query is most similar to the given one, if similar enough.
+        """
+        vectors = self.vectors.get((text_type, model))
+        if vectors is None:
+            return None
+        similarities = vectors @ vector
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.threshold:
+            return None
+        return self.responses[(text_type, model)][best]
+
+    def add(self, text_type: str, model: str, vector: np.ndarray, response: msgspec.Struct) -> None:
+        """
+        Remembers the response for the query, dropping the oldest entries beyond the size limit.
+        """
+        key = (text_type, model)
+        vectors = self.vectors.get(key)
+        vectors = vector[np.newaxis, :] if vectors is None else np.vstack([vectors, vector])
+        self.vectors[key] = vectors[-self.max_entries:]
+        self.responses[key].append(response)
+        del self.responses[key][:-self.max_entries]
+
+semantic_cache = SemanticCache(SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_SIZE)
+
+# Precompile the prompts: embed the static format instructions once so each request only fills in
+# the query and chat history. Braces in the JSON schema are escaped so str.format leaves them alone.
+def build_prompt(template: str, struct_type: Type[msgspec.Struct]) -> str:
+    format_instructions = get_format_instructions(struct_type).replace("{", "{{").replace("}", "}}")
+    return template.replace("{format_instructions}", format_instructions)
+
+THIRU_PREFIX = build_prompt(thirukkural_template, ThirukkuralResponse)
+GITA_PREFIX = build_prompt(bhagavad_gita_template, BhagavadGitaResponse)
+
+# Maximum number of messages kept in each chat history
+MAX_HISTORY_MESSAGES = 10
+
+# Initialize message histories: per session, one ring buffer of pre-rendered messages for each text type
+def new_session_histories() -> Dict[str, Deque[str]]:
+    return {
+        "thirukkural": deque(maxlen=MAX_HISTORY_MESSAGES),
+        "bhagavad_gita": deque(maxlen=MAX_HISTORY_MESSAGES),
+    }
 
-bhagavad_gita_prompt = PromptTemplate(
-    template=bhagavad_gita_template,
-    input_variables=["query", "chat_history"],
-    partial_variables={"format_instructions": gita_parser.get_format_instructions()},
-)
+# Maximum number of sessions kept in memory; the least recently used session is dropped beyond this
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "1000"))
 
-# Initialize message histories
-thirukkural_history = ChatMessageHistory()
-bhagavad_gita_history = ChatMessageHistory()
+SESSIONS: OrderedDict[str, Dict[str, Deque[str]]] = OrderedDict()
+
+# Function to get the histories of a session, creating them on first use
+def get_session_histories(session_id: str) -> Dict[str, Deque[str]]:
+    histories = SESSIONS.get(session_id)
+    if histories is None:
+        histories = SESSIONS[session_id] = new_session_histories()
+        if len(SESSIONS) > MAX_SESSIONS:
+            SESSIONS.popitem(last=False)
+    else:
+        SESSIONS.move_to_end(session_id)
+    return histories
+
+# One lock per session guarding its histories; requests from different sessions never contend.
+# A lock only exists while some request holds or waits on it, counted in session_lock_users.
+session_locks: Dict[str, asyncio.Lock] = {}
+session_lock_users: Counter = Counter()
+
+@asynccontextmanager
+async def session_lock(session_id: str):
+    lock = session_locks.setdefault(session_id, asyncio.Lock())
+    session_lock_users[session_id] += 1
+    try:
+        async with lock:
+            yield
+    finally:
+        session_lock_users[session_id] -= 1
+        if not session_lock_users[session_id]:
+            del session_lock_users[session_id]
+            del session_locks[session_id]
 
 # Function to convert message history to formatted string
-def format_chat_history(history, max_messages=10):
-    messages = history.messages[-max_messages:]  # Limit to last 10 messages
-    return "\n".join(f"{'User' if isinstance(msg, HumanMessage) else 'Assistant'}: {msg.content}" for msg in messages)
+def format_chat_history(history: Deque[str]) -> str:
+    return "\n".join(history)
+
+# Function to record one exchange in a message history
+def add_exchange(history: Deque[str], query: str, result_summary: str) -> None:
+    history.append(f"User: {query}")
+    history.append(f"Assistant: {result_summary}")
+
+# Function to get the most recent user query from a message history
+def last_user_query(history: Deque[str]) -> str:
+    return history[-2][len("User: "):] if len(history) >= 2 else ""
+
+# Function to compile a case-insensitive pattern matching any of the keywords
+def keyword_pattern(keywords: List[str]) -> re.Pattern:
+    return re.compile("|".join(re.escape(keyword) for keyword in keywords), re.IGNORECASE)
+
+# Keywords for Thirukkural
+THIRUKKURAL_PATTERN = keyword_pattern(["thirukkural", "kural", "tamil", "aram", "porul", "inbam"])
+
+# Keywords for Bhagavad Gita
+GITA_PATTERN = keyword_pattern(["bhagavad gita", "gita", "krishna", "arjuna", "yoga", "dharma"])
+
+# Keywords that mark a short query as a follow-up request
+FOLLOW_UP_PATTERN = keyword_pattern(["thirukkural", "kural", "bhagavad gita", "gita", "similar", "same"])
+
+# Keyword that points a follow-up request at Thirukkural ("thirukkural" contains it too)
+KURAL_PATTERN = keyword_pattern(["kural"])
+
+# Word that marks a query as asking for the story, which is worth the pro model. Matched as a whole
+# word so "history" or "storyline" don't count.
+STORY_PATTERN = re.compile(r"\bstor(?:y|ies)\b", re.IGNORECASE)
 
 # Function to determine the text type based on the query
 def determine_text_type(query: str) -> str:
-    query_lower = query.lower()
-    
-    # Keywords for Thirukkural
-    thirukkural_keywords = ["thirukkural", "kural", "tamil", "aram", "porul", "inbam"]
-    
-    # Keywords for Bhagavad Gita
-    gita_keywords = ["bhagavad gita", "gita", "krishna", "arjuna", "yoga", "dharma"]
-    
     # Check for Thirukkural keywords
-    if any(keyword in query_lower for keyword in thirukkural_keywords):
+    if THIRUKKURAL_PATTERN.search(query):
         return "thirukkural"
-    
+
     # Check for Bhagavad Gita keywords
-    elif any(keyword in query_lower for keyword in gita_keywords):
+    elif GITA_PATTERN.search(query):
         return "bhagavad_gita"
-    
+
     # Default to Thirukkural if no specific text is mentioned
     else:
         return "thirukkural"
 
+# Function to embed a query as a unit vector for the semantic cache
+async def embed_query(query: str) -> Optional[np.ndarray]:
+    try:
+        vector = np.asarray(await embeddings_client.aembed_query(query), dtype=np.float32)
+    except Exception as e:
+        logging.warning(f"Error embedding query, skipping semantic cache: {e}")
+        return None
+    return vector / np.linalg.norm(vector)
+
+# Function to stream a completion from Gemini and decode it into a response struct
+async def stream_completion(llm: ChatGoogleGenerativeAI, prompt: str, decoder: msgspec.json.Decoder) -> Tuple[msgspec.Struct, Optional[asyncio.Task]]:
+    """
+    Streams the model output for the prompt. As soon as every early translated field has been generated,
+    their translation starts in the background while the model keeps generating the story.
+    Returns the decoded response and the early translation task, if one was started.
+    Streaming bypasses LangChain's cache lookup, so the LLM cache is consulted and filled here.
+    """
+    llm_cache = get_llm_cache()
+    llm_string = f"{llm.model}:{llm.temperature}"
+    # The SQLite cache blocks on disk I/O, so its async methods run it in a worker thread
+    cached = await llm_cache.alookup(prompt, llm_string)
+    if cached:
+        return decode_response(decoder, cached[0].text), None
+
+    content = ""
+    early_translation = None
+    early_extraction_failed = False
+    try:
+        async for chunk in llm.astream(prompt):
+            content += chunk.content
+            if early_translation is None and not early_extraction_failed:
+                try:
+                    fields = {
+                        match.group(1): json.loads(match.group(2), strict=False)
+                        for match in COMPLETED_FIELD_PATTERN.finditer(content)
+                    }
+                except ValueError as e:
+                    # The early translation is optional; the fields are translated after decoding instead
+                    logging.warning(f"Skipping early translation, could not read streamed fields: {e}")
+                    early_extraction_failed = True
+                    continue
+                if len(fields) == len(EARLY_TRANSLATED_FIELDS):
+                    early_translation = asyncio.create_task(translate_batch_async(
+                        http_session,
+                        [fields[field] for field in EARLY_TRANSLATED_FIELDS],
+                        SUPPORTED_LANGUAGES,
+                    ))
+
+        parsed_response = decode_response(decoder, content)
+    except BaseException:
+        # Don't leave the early translation running unawaited if streaming or decoding fails
+        if early_translation is not None:
+            early_translation.cancel()
+        raise
+
+    await llm_cache.aupdate(prompt, llm_string, [Generation(text=content)])
+    return parsed_response, early_translation
+
+# Function to translate the generated response into all supported languages
+async def translate_response(generated_response: Dict[str, Any], early_translation: Optional[asyncio.Task]) -> Dict[str, Dict[str, str]]:
+    """
+    Translates the fields not already covered by the early translation task with a single request,
+    then merges both results per language.
+    """
+    if early_translation is None:
+        late_fields = TRANSLATED_FIELDS
+    else:
+        late_fields = tuple(field for field in TRANSLATED_FIELDS if field not in EARLY_TRANSLATED_FIELDS)
+
+    batches = [(late_fields, translate_batch_async(
+        http_session,
+        [generated_response[field] for field in late_fields],
+        SUPPORTED_LANGUAGES,
+    ))]
+    if early_translation is not None:
+        batches.append((EARLY_TRANSLATED_FIELDS, early_translation))
+
+    results = await asyncio.gather(*(batch for _, batch in batches), return_exceptions=True)
+
+    translations = {lang: {} for lang in SUPPORTED_LANGUAGES}
+    for (fields, _), result in zip(batches, results):
+        if isinstance(result, Exception):
+            logging.error(f"Error translating response: {result}")
+            result = {lang: ["Translation failed."] * len(fields) for lang in SUPPORTED_LANGUAGES}
+        for lang, texts in result.items():
+            translations[lang].update(zip(fields, texts))
+    return translations
+
 # Function to generate response based on text type
-def generate_response(query: str, text_type: str) -> Dict[str, Any]:
+async def generate_response(query: str, text_type: str, history: Deque[str], llm: ChatGoogleGenerativeAI) -> Dict[str, Any]:
     try:
+        chat_history = format_chat_history(history)
+
+        # Queries without conversation context can reuse the response to a similar earlier query
+        query_vector = await embed_query(query) if not history else None
+        cached_response = semantic_cache.lookup(text_type, llm.model, query_vector) if query_vector is not None else None
+
+        if cached_response is not None:
+            parsed_response, early_translation = cached_response, None
+        elif text_type == "thirukkural":
+            formatted_prompt = THIRU_PREFIX.format(query=query, chat_history=chat_history)
+            parsed_response, early_translation = await stream_completion(llm, formatted_prompt, thirukkural_decoder)
+        else:
+            formatted_prompt = GITA_PREFIX.format(query=query, chat_history=chat_history)
+            parsed_response, early_translation = await stream_completion(llm, formatted_prompt, gita_decoder)
+
         if text_type == "thirukkural":
-            chat_history = format_chat_history(thirukkural_history)
-            formatted_prompt = thirukkural_prompt.format(query=query, chat_history=chat_history)
-            response = genai_client.invoke(formatted_prompt)
-            parsed_response = thirukkural_parser.parse(response.content)
             result_summary = f"Thirukkural about {parsed_response.section.lower()} - Translation: {parsed_response.translation}"
-            thirukkural_history.add_user_message(query)
-            thirukkural_history.add_ai_message(result_summary)
-            generated_response = parsed_response.dict()
         else:
-            chat_history = format_chat_history(bhagavad_gita_history)
-            formatted_prompt = bhagavad_gita_prompt.format(query=query, chat_history=chat_history)
-            response = genai_client.invoke(formatted_prompt)
-            parsed_response = gita_parser.parse(response.content)
             result_summary = f"Bhagavad Gita {parsed_response.chapter} - Translation: {parsed_response.translation}"
-            bhagavad_gita_history.add_user_message(query)
-            bhagavad_gita_history.add_ai_message(result_summary)
-            generated_response = parsed_response.dict()
-
-        # Translate the generated response into supported languages
-        translations = {}
-        for lang in ["ta", "hi", "ml", "te", "bn", "gu", "kn", "mr", "pa", "ur"]:  # Add new languages here
-            try:
-                translations[lang] = {
-                    "translation": translate_text(generated_response["translation"], lang),
-                    "explanation": translate_text(generated_response["explanation"], lang),
-                    "story": translate_text(generated_response["story"], lang),
-                }
-            except Exception as e:
-                logging.error(f"Error translating to {lang}: {e}")
-                translations[lang] = {
-                    "translation": "Translation failed.",
-                    "explanation": "Translation failed.",
-                    "story": "Translation failed.",
-                }
+        add_exchange(history, query, result_summary)
+
+        if query_vector is not None and cached_response is None:
+            semantic_cache.add(text_type, llm.model, query_vector, parsed_response)
+        generated_response = msgspec.structs.asdict(parsed_response)
 
         # Add translations to the response
-        generated_response["translations"] = translations
+        generated_response["translations"] = await translate_response(generated_response, early_translation)
         return generated_response
 
     except Exception as e:
@@ -187,128 +454,221 @@ def is_follow_up_query(query: str) -> bool:
     """
     Determine if the query is a follow-up request for either Thirukkural or Bhagavad Gita.
     """
-    query_lower = query.lower()
     # Check if the query is short and contains keywords related to Thirukkural or Bhagavad Gita
     return (
-        len(query_lower.split()) <= 5 and  # Short query
-        any(keyword in query_lower for keyword in ["thirukkural", "kural", "bhagavad gita", "gita", "similar", "same"])
+        len(query.split()) <= 5 and  # Short query
+        FOLLOW_UP_PATTERN.search(query) is not None
     )
 
-# Function to translate text using Azure Translator API
-def translate_text(text: str, target_language: str) -> str:
+# Function to pick the Gemini model for a query
+def select_llm(query: str) -> ChatGoogleGenerativeAI:
     """
-    Translates the given text into the target language using Azure Translator API.
+    Routes short follow-up requests ("similar kural", "same gita") to gemini-1.5-flash; every other
+    query, and any follow-up that explicitly asks for a story, is generated by gemini-1.5-pro.
     """
-    translator_key = os.getenv("AZURE_TRANSLATOR_KEY")
-    translator_endpoint = os.getenv("AZURE_TRANSLATOR_ENDPOINT")
-
-    if not translator_key or not translator_endpoint:
-        raise ValueError("Azure Translator API key or endpoint is not set in the environment variables.")
-
-    # Azure Translator API URL
-    url = f"{translator_endpoint}/translate?api-version=3.0&to={target_language}"
-
-    # Headers for the API request
-    headers = {
-        "Ocp-Apim-Subscription-Key": translator_key,
-        "Ocp-Apim-Subscription-Region": "centralindia",  # Replace with your Azure region if needed
-        "Content-Type": "application/json"
-    }
+    if is_follow_up_query(query) and not STORY_PATTERN.search(query):
+        return flash_client
+    return pro_client
+
+# Function to build the translation cache key for a text and target language
+def translation_cache_key(text: str, target_language: str) -> str:
+    return hashlib.blake2b(text.encode() + b"\0" + target_language.encode(), digest_size=8).hexdigest()
+
+# Function to read cached translations for every (text, language) pair; blocking, run off the event loop
+def load_cached_translations(texts: List[str], target_languages: List[str]) -> Dict[Tuple[str, str], str]:
+    translated = {}
+    for text in texts:
+        for lang in target_languages:
+            cached = translation_cache.get(translation_cache_key(text, lang))
+            if cached is not None:
+                translated[(text, lang)] = cached
+    return translated
+
+# Function to store translations in one cache transaction; blocking, run off the event loop
+def store_cached_translations(translations: Dict[Tuple[str, str], str]) -> None:
+    with translation_cache.transact():
+        for (text, lang), translated_text in translations.items():
+            translation_cache.set(translation_cache_key(text, lang), translated_text)
+
+# Function to translate texts using Azure Translator API
+async def translate_batch_async(session: aiohttp.ClientSession, texts: List[str], target_languages: List[str]) -> Dict[str, List[str]]:
+    """
+    Translates every text into every target language with one Azure Translator API request.
+    Returns a mapping of language code to the translated texts, in the order they were given.
+    Repeated texts are sent once, and (text, language) pairs already in the translation cache are
+    left out of the request and spliced back into the result.
+    """
+    unique_texts = list(dict.fromkeys(texts))
+    translated = await asyncio.to_thread(load_cached_translations, unique_texts, target_languages)
+
+    missing_texts = [text for text in unique_texts if any((text, lang) not in translated for lang in target_languages)]
+    missing_languages = [lang for lang in target_languages if any((text, lang) not in translated for text in missing_texts)]
+
+    if missing_texts:
+        translator_key = os.getenv("AZURE_TRANSLATOR_KEY")
+        translator_endpoint = os.getenv("AZURE_TRANSLATOR_ENDPOINT")
+
+        if not translator_key or not translator_endpoint:
+            raise ValueError("Azure Translator API key or endpoint is not set in the environment variables.")
+
+        # Azure Translator API URL, with one "to" parameter per target language
+        url = f"{translator_endpoint}/translate?api-version=3.0&" + "&".join(f"to={lang}" for lang in missing_languages)
+
+        # Request body
+        body = [{"text": text} for text in missing_texts]
+
+        # Make the API request, retrying throttled and transient failures with jittered exponential backoff
+        async for attempt in AsyncRetrying(
+            stop=stop_after_attempt(5),
+            wait=wait_exponential_jitter(initial=0.2, max=5),
+            retry=retry_if_exception_type((TranslatorRetryableError, aiohttp.ClientConnectionError)),
+            reraise=True,
+        ):
+            with attempt:
+                async with azure_semaphore, session.post(url, json=body) as response:
+                    if response.status in RETRYABLE_STATUSES:
+                        raise TranslatorRetryableError(f"Azure Translator API error: {response.status} - {await response.text()}")
+                    if response.status != 200:
+                        raise Exception(f"Azure Translator API error: {response.status} - {await response.text()}")
+
+                    # Parse the response: one entry per input text, each holding one translation per target language
+                    data = await response.json()
+
+        new_translations = {
+            (text, lang): translation["text"]
+            for text, item in zip(missing_texts, data)
+            for lang, translation in zip(missing_languages, item["translations"])
+        }
+        await asyncio.to_thread(store_cached_translations, new_translations)
+        translated.update(new_translations)
+
+    return {lang: [translated[(text, lang)] for text in texts] for lang in target_languages}
+
+# Initialize Quart app
+app = Quart(__name__)
+
+@app.before_serving
+async def open_http_session():
+    global http_session
+    http_session = aiohttp.ClientSession(
+        # Keep connections to Azure alive and reuse them across requests
+        connector=aiohttp.TCPConnector(limit=64, limit_per_host=32, ttl_dns_cache=300),
+        timeout=aiohttp.ClientTimeout(total=30),
+        # Headers for the Azure Translator API requests
+        headers={
+            "Ocp-Apim-Subscription-Key": os.getenv("AZURE_TRANSLATOR_KEY", ""),
+            "Ocp-Apim-Subscription-Region": "centralindia",  # Replace with your Azure region if needed
+            "Content-Type": "application/json"
+        },
+    )
 
-    # Request body
-    body = [{"text": text}]
+@app.after_serving
+async def close_http_session():
+    await http_session.close()
 
-    # Make the API request
-    response = requests.post(url, headers=headers, json=body)
-    if response.status_code != 200:
-        raise Exception(f"Azure Translator API error: {response.status_code} - {response.text}")
+# Function to build a JSON response with orjson, which writes UTF-8 directly instead of \uXXXX escapes
+def ojsonify(obj: Any, status: int = 200):
+    return app.response_class(orjson.dumps(obj), status=status, mimetype="application/json")
 
-    # Parse the response
-    translated_text = response.json()[0]["translations"][0]["text"]
-    return translated_text
+# Identify the conversation from the X-Session-Id header, minting a new session id on first contact
+@app.before_request
+async def load_session_id():
+    g.session_id = request.headers.get("X-Session-Id") or uuid4().hex
 
-# Initialize Flask app
-app = Flask(__name__)
+@app.after_request
+async def send_session_id(response):
+    response.headers["X-Session-Id"] = g.session_id
+    return response
 
 # Route for handling queries
 @app.route("/query", methods=["POST"])
-def handle_query():
-    data = request.json
+async def handle_query():
+    data = await request.get_json()
+    if not isinstance(data, dict):
+        return ojsonify({"error": "Request body must be a JSON object"}, 400)
     query = data.get("query")
     if not query:
-        return jsonify({"error": "Query is required"}), 400
+        return ojsonify({"error": "Query is required"}, 400)
 
     # Handle introductory chat inputs
     if query.lower() in ["hi", "hello", "hey", "hi there", "hello there"]:
-        return jsonify({
+        return ojsonify({
             "verse": "Greeting",
             "translation": "Hello! I'm a sacred text chatbot. How can I assist you today?",
             "section": "Greeting",
             "explanation": "This is a friendly greeting to start the conversation.",
             "story": "No story here, just a warm welcome!",
-            "languages": ["ta", "hi", "ml", "te", "bn", "gu", "kn", "mr", "pa", "ur"],  # Add new languages here
+            "languages": SUPPORTED_LANGUAGES,
             "ready_for_translation": True  # Indicate that translation options should be shown
         })
 
     text_type = determine_text_type(query)
+    llm = select_llm(query)
 
-    # Handle follow-up query dynamically
-    if is_follow_up_query(query):
-        if "thirukkural" in query.lower() or "kural" in query.lower():
-            text_type = "thirukkural"
-            last_query = bhagavad_gita_history.messages[-2].content if len(bhagavad_gita_history.messages) >= 2 else ""
-        else:
-            text_type = "bhagavad_gita"
-            last_query = thirukkural_history.messages[-2].content if len(thirukkural_history.messages) >= 2 else ""
+    # Hold the session lock while reading and updating its histories, so concurrent requests
+    # from the same conversation are applied one at a time
+    async with session_lock(g.session_id):
+        histories = get_session_histories(g.session_id)
+
+        # Handle follow-up query dynamically
+        if is_follow_up_query(query):
+            if KURAL_PATTERN.search(query):
+                text_type = "thirukkural"
+                last_query = last_user_query(histories["bhagavad_gita"])
+            else:
+                text_type = "bhagavad_gita"
+                last_query = last_user_query(histories["thirukkural"])
 
-        query = f"{last_query} (in {text_type.replace('_', ' ').title()})"
+            query = f"{last_query} (in {text_type.replace('_', ' ').title()})"
 
-    response = generate_response(query, text_type)
+        response = await generate_response(query, text_type, histories[text_type], llm)
 
     # Add translation options to the response
-    response["languages"] = ["ta", "hi", "ml", "te", "bn", "gu", "kn", "mr", "pa", "ur"]  # Add new languages here
+    response["languages"] = SUPPORTED_LANGUAGES
     response["ready_for_translation"] = True  # Indicate that translation options should be shown
 
-    return jsonify(response)
+    return ojsonify(response)
 
 # Route to handle translation requests
 @app.route("/translate", methods=["POST"])
-def handle_translation():
-    data = request.json
+async def handle_translation():
+    data = await request.get_json()
+    if not isinstance(data, dict):
+        return ojsonify({"error": "Request body must be a JSON object"}, 400)
     text = data.get("text")
     explanation = data.get("explanation")
     story = data.get("story")
     target_language = data.get("language")
 
     if not text or not explanation or not story or not target_language:
-        return jsonify({"error": "Text, explanation, story, and target language are required"}), 400
+        return ojsonify({"error": "Text, explanation, story, and target language are required"}, 400)
 
     try:
-        translated_text = translate_text(text, target_language)
-        translated_explanation = translate_text(explanation, target_language)
-        translated_story = translate_text(story, target_language)
+        batch = await translate_batch_async(http_session, [text, explanation, story], [target_language])
+        translated_text, translated_explanation, translated_story = batch[target_language]
 
-        return jsonify({
+        return ojsonify({
             "translated_text": translated_text,
             "translated_explanation": translated_explanation,
             "translated_story": translated_story,
-            "languages": ["ta", "hi", "ml", "te", "bn", "gu", "kn", "mr", "pa", "ur"],  # Add new languages here
+            "languages": SUPPORTED_LANGUAGES,
             "ready_for_translation": True  # Indicate that translation options should be shown again
         })
     except Exception as e:
         logging.error(f"Error during translation: {e}")
-        return jsonify({"error": str(e)}), 500
+        return ojsonify({"error": str(e)}, 500)
 
 # Route for clearing conversation history
 @app.route("/clear_history", methods=["POST"])
-def clear_history():
-    thirukkural_history.clear()
-    bhagavad_gita_history.clear()
-    return jsonify({"message": "Conversation history cleared!"})
+async def clear_history():
+    async with session_lock(g.session_id):
+        SESSIONS.pop(g.session_id, None)
+    return ojsonify({"message": "Conversation history cleared!"})
 
 @app.route("/")
-def home():
-    return render_template("index.html")
+async def home():
+    return await render_template("index.html")
 
+# Development server only; production runs under gunicorn (see start.sh and gunicorn.conf.py)
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=os.getenv("APP_DEBUG") == "1")
\ No newline at end of file
@@ -0,0 +1,28 @@
+import os
+
+# Listen on the same port the app has always used
+bind = os.getenv("BIND", "0.0.0.0:5000")
+
+# A single worker by default: chat histories, session locks and the semantic cache live in process
+# memory, so a second worker would not see a session's history. One uvicorn worker still serves many
+# requests concurrently on its asyncio event loop.
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Import the app once in the master so workers fork with the LangChain/Gemini clients, response
+# structs and compiled prompts already loaded. The Gemini clients open their gRPC channels lazily on
+# first use and the aiohttp session is opened per worker when it starts serving.
+preload_app = True
+
+# A query waits on Gemini and Azure Translator, which can take well over gunicorn's 30 s default
+timeout = 120
+
+
+def post_fork(server, worker):
+    # Creating the SQLite LLM cache in the master left a pooled sqlite3 connection in its SQLAlchemy
+    # engine. Drop the inherited pool without closing the master's connections so the worker opens its
+    # own; SQLite connections must not be used across a fork. The diskcache translation cache reopens
+    # its connection by itself when it notices the process id changed.
+    from langchain_core.globals import get_llm_cache
+
+    get_llm_cache().engine.dispose(close=False)
@@ -1,3 +1,4 @@
 #!/bin/bash
 
-gunicorn --bind 0.0.0.0:5000 app:app
\ No newline at end of file
+# Worker settings live in gunicorn.conf.py
+gunicorn app:app
\ No newline at end of file
@@ -3,6 +3,26 @@ const chatInput = document.getElementById('chat-input');
 const sendButton = document.getElementById('send-button');
 const clearButton = document.getElementById('clear-button');
 
+// Session id issued by the server, sent back so the conversation history stays per user
+let sessionId = sessionStorage.getItem('sessionId');
+
+// Function to build request headers including the session id
+function sessionHeaders(headers = {}) {
+    if (sessionId) {
+        headers['X-Session-Id'] = sessionId;
+    }
+    return headers;
+}
+
+// Function to remember the session id returned by the server
+function rememberSession(response) {
+    const id = response.headers.get('X-Session-Id');
+    if (id) {
+        sessionId = id;
+        sessionStorage.setItem('sessionId', id);
+    }
+}
+
 // Function to send a message
 async function sendMessage() {
     const message = chatInput.value.trim();
@@ -24,11 +44,12 @@ async function sendMessage() {
     try {
         const response = await fetch('/query', {
             method: 'POST',
-            headers: {
+            headers: sessionHeaders({
                 'Content-Type': 'application/json',
-            },
+            }),
             body: JSON.stringify({ query: message }),
         });
+        rememberSession(response);
 
         if (!response.ok) {
             throw new Error(`HTTP error! Status: ${response.status}`);
@@ -218,11 +239,12 @@ async function translateMessage(text, explanation, story, language) {
     try {
         const response = await fetch('/translate', {
             method: 'POST',
-            headers: {
+            headers: sessionHeaders({
                 'Content-Type': 'application/json',
-            },
+            }),
             body: JSON.stringify({ text, explanation, story, language }),
         });
+        rememberSession(response);
 
         if (!response.ok) {
             throw new Error(`HTTP error! Status: ${response.status}`);
@@ -266,6 +288,7 @@ async function clearHistory() {
     try {
         const response = await fetch('/clear_history', {
             method: 'POST',
+            headers: sessionHeaders(),
         });
 
         if (!response.ok) {